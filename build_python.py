@@ -3,8 +3,13 @@ import shutil
 import subprocess
 import sys
 import os
+import hashlib
+import json
 from pathlib import Path
 from ccdc.thirdparty.package import Package, AutoconfMixin, MakeInstallMixin, NoArchiveMixin, CMakeMixin
+from ccdc.thirdparty.artifacts import ArtifactIndex
+from ccdc.thirdparty import progress
+from ccdc.thirdparty.reproducible import reproducible_archives_requested, create_reproducible_archive, compile_checked_hash_pycs
 
 
 package_name = 'base_python'
@@ -173,6 +178,16 @@ def install_pyenv():
         subprocess.run(['git clone https://github.com/pyenv/pyenv.git /tmp/pyenvinst'], shell=True, check=True)
 
 
+def run_python_build(command, version, env):
+    '''run python-build with progress reporting, logging alongside the Package build logs'''
+    build_logs = Package().build_logs
+    progress.reporter().message(f'Running {command}')
+    progress.run_logged(
+        command, f'{package_name} python-build', f'{package_name}-{version}:python-build',
+        build_logs / progress.TIMINGS_FILENAME, build_logs / f'{package_name}-{version}-python-build.log',
+        env=env, shell=True)
+
+
 def install_pyenv_version(version):
     python_build_env = dict(os.environ)
     if macos():
@@ -188,20 +203,38 @@ def install_pyenv_version(version):
                 f"--with-macosx-version-min={macos_deployment_target}"
                 )
         python_build_env['CONFIGURE_OPTS'] = f"--with-macosx-version-min={macos_deployment_target}"
-        subprocess.run(f'sudo -E python-build {version} {python_version_destdir()}', shell=True, check=True, env=python_build_env)
+        run_python_build(f'sudo -E python-build {version} {python_version_destdir()}', version, python_build_env)
         return
     if linux():
         if rocky():
             python_build_env['LDFLAGS'] = f"{python_build_env.get('LDFLAGS', '')} -L{python_version_destdir()}/lib -L/usr/lib64/openssl -L/usr/lib64 -lssl -lcrypto -lz -lm -ldl -lpthread"
             python_build_env['CPPFLAGS'] = f"{python_build_env.get('CPPFLAGS', '')} -I{python_version_destdir()}/include -I/usr/include/openssl"
         python_build_env['PATH']=f"/tmp/pyenvinst/plugins/python-build/bin:{python_build_env['PATH']}"
-    subprocess.run(f'sudo env "PATH=$PATH" python-build {version} {python_version_destdir()}', shell=True, check=True, env=python_build_env)
+    run_python_build(f'sudo env "PATH=$PATH" python-build {version} {python_version_destdir()}', version, python_build_env)
 
 
 def output_archive_filename():
     return f'{output_base_name()}.tar.gz'
 
 
+def build_profile():
+    if macos():
+        return f'release-macos{macos_deployment_target}'
+    return 'release'
+
+
+def input_hash():
+    inputs = {
+        'package': package_name,
+        'python_version': python_version,
+        'platform': platform(),
+        'profile': build_profile(),
+    }
+    if rocky():
+        inputs['sqlite'] = SqlitePackage().input_hash
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+
 def smoke_test():
     subprocess.check_call([f'{ python_interpreter() }', '-m', 'pip', 'install', 'packaging'])
     subprocess.check_call([f'{ python_interpreter() }', 'smoke_test.py'])
@@ -215,6 +248,22 @@ def create_archive():
         archive_output_directory = python_destdir() / 'packages'
     archive_output_directory.mkdir(parents=True, exist_ok=True)
     print(f'Creating {output_archive_filename()} in {archive_output_directory}')
+    if reproducible_archives_requested():
+        # python-build ran under sudo, so the install, and its __pycache__ directories, belong to root
+        compile_checked_hash_pycs(python_interpreter(), python_version_destdir(), sudo=not windows())
+        create_reproducible_archive(
+            python_destdir(),
+            python_version_destdir().relative_to(python_destdir()),
+            archive_output_directory / output_archive_filename())
+    else:
+        create_tar_archive(archive_output_directory)
+    with ArtifactIndex() as index:
+        row = index.add(archive_output_directory / output_archive_filename(), profile=build_profile(), input_hash=input_hash())
+        for duplicate in index.duplicates(row):
+            print(f'{output_archive_filename()} is identical to {duplicate["path"]}')
+
+
+def create_tar_archive(archive_output_directory):
     command = [
         'tar',
         '-zcf',
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+'''Local index of the archives produced by create_archive()
+
+Archives are named name-version-buildnumber-platform[-vsNNNN].tar.gz. The
+index records each one in an SQLite database so that builds and caches can
+find a reusable artifact with a single query instead of listing directories.
+
+    python -m ccdc.thirdparty.artifacts scan /opt/ccdc/third-party-sources/builds
+    python -m ccdc.thirdparty.artifacts latest base_python 3.11 ubuntu22.04
+'''
+
+import sys
+import os
+import re
+import hashlib
+import sqlite3
+import argparse
+import time
+from pathlib import Path
+
+
+ARCHIVE_SUFFIX = '.tar.gz'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS artifacts (
+    path TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    name TEXT NOT NULL,
+    version TEXT NOT NULL,
+    build_number TEXT NOT NULL,
+    platform TEXT NOT NULL,
+    vs_version TEXT,
+    profile TEXT,
+    input_hash TEXT,
+    size INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS artifacts_lookup ON artifacts (name, platform, version);
+CREATE INDEX IF NOT EXISTS artifacts_input_hash ON artifacts (input_hash);
+CREATE INDEX IF NOT EXISTS artifacts_sha256 ON artifacts (sha256);
+'''
+
+_COLUMNS = ('path', 'filename', 'name', 'version', 'build_number', 'platform', 'vs_version',
+            'profile', 'input_hash', 'size', 'sha256', 'mtime', 'indexed_at')
+
+
+def default_index_path():
+    '''Return the database used when no explicit index is given'''
+    if 'CCDC_ARTIFACT_INDEX' in os.environ:
+        return Path(os.environ['CCDC_ARTIFACT_INDEX'])
+    if sys.platform == 'win32':
+        return Path('D:\\tp\\artifacts.sqlite')
+    else:
+        return Path('/opt/ccdc/third-party-sources/artifacts.sqlite')
+
+
+def parse_archive_filename(filename):
+    '''Split an archive filename into the components of Package.output_base_name
+
+    The build number may itself contain dashes (developer builds use a
+    placeholder such as do-not-use-me-developer-version), so everything
+    between the version and the platform is taken as the build number.
+    Returns None for files that do not follow the naming scheme.
+    '''
+    if not filename.endswith(ARCHIVE_SUFFIX):
+        return None
+    components = filename[:-len(ARCHIVE_SUFFIX)].split('-')
+    vs_version = None
+    if len(components) > 4 and re.fullmatch(r'vs\d+', components[-1]):
+        vs_version = components.pop()[2:]
+    if len(components) < 4:
+        return None
+    return {
+        'name': components[0],
+        'version': components[1],
+        'build_number': '-'.join(components[2:-1]),
+        'platform': components[-1],
+        'vs_version': vs_version,
+    }
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    '''Digest a file without reading it all into memory'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _version_key(version):
+    return tuple(int(c) if c.isdigit() else -1 for c in re.split(r'[.+]', version))
+
+
+def _build_number_key(build_number):
+    # developer builds never win over numbered CI builds
+    return int(build_number) if build_number.isdigit() else -1
+
+
+class ArtifactIndex(object):
+    '''SQLite index of published archives'''
+
+    def __init__(self, path=None):
+        self.path = Path(path) if path else default_index_path()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(self.path))
+        self.connection.row_factory = sqlite3.Row
+        self.connection.executescript(_SCHEMA)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add(self, archive_path, profile=None, input_hash=None):
+        '''Record (or refresh) an archive; returns the stored row'''
+        archive_path = Path(archive_path).resolve()
+        components = parse_archive_filename(archive_path.name)
+        if components is None:
+            raise ValueError(f'{archive_path.name} does not look like a name-version-build-platform archive')
+        st = archive_path.stat()
+        existing = self.get(archive_path)
+        if existing is not None and existing['size'] == st.st_size and existing['mtime'] == st.st_mtime:
+            # unchanged on disk, so the digest is still good
+            sha256 = existing['sha256']
+            profile = profile if profile is not None else existing['profile']
+            input_hash = input_hash if input_hash is not None else existing['input_hash']
+        else:
+            sha256 = file_sha256(archive_path)
+        row = dict(components)
+        row.update({
+            'path': str(archive_path),
+            'filename': archive_path.name,
+            'profile': profile,
+            'input_hash': input_hash,
+            'size': st.st_size,
+            'sha256': sha256,
+            'mtime': st.st_mtime,
+            'indexed_at': time.time(),
+        })
+        with self.connection:
+            self.connection.execute(
+                f'INSERT OR REPLACE INTO artifacts ({", ".join(_COLUMNS)}) VALUES ({", ".join("?" * len(_COLUMNS))})',
+                [row[c] for c in _COLUMNS])
+        return self.get(archive_path)
+
+    def get(self, archive_path):
+        return self.connection.execute(
+            'SELECT * FROM artifacts WHERE path = ?', (str(Path(archive_path).resolve()),)).fetchone()
+
+    def scan(self, directory):
+        '''Index every archive in a directory and forget ones that disappeared from it'''
+        directory = Path(directory).resolve()
+        added = []
+        for archive_path in sorted(directory.glob(f'*{ARCHIVE_SUFFIX}')):
+            if parse_archive_filename(archive_path.name) is None:
+                continue
+            added.append(self.add(archive_path))
+        with self.connection:
+            for row in self.connection.execute('SELECT path FROM artifacts').fetchall():
+                path = Path(row['path'])
+                if path.parent == directory and not path.exists():
+                    self.connection.execute('DELETE FROM artifacts WHERE path = ?', (row['path'],))
+        return added
+
+    def query(self, name=None, version=None, platform=None, input_hash=None, sha256=None):
+        '''Return matching rows, newest first
+
+        version matches exactly or as a prefix on a dot boundary, so
+        3.11 finds 3.11.6 but not 3.110.
+        '''
+        clauses = []
+        parameters = []
+        if name is not None:
+            clauses.append('name = ?')
+            parameters.append(name)
+        if version is not None:
+            # compare literally: LIKE would treat _ and % as wildcards and ignore case
+            clauses.append("(version = ? OR substr(version, 1, length(?) + 1) = ? || '.')")
+            parameters.extend([version, version, version])
+        if platform is not None:
+            clauses.append('platform = ?')
+            parameters.append(platform)
+        if input_hash is not None:
+            clauses.append('input_hash = ?')
+            parameters.append(input_hash)
+        if sha256 is not None:
+            clauses.append('sha256 = ?')
+            parameters.append(sha256)
+        sql = 'SELECT * FROM artifacts'
+        if clauses:
+            sql += ' WHERE ' + ' AND '.join(clauses)
+        rows = self.connection.execute(sql, parameters).fetchall()
+        return sorted(
+            rows,
+            key=lambda r: (_version_key(r['version']), _build_number_key(r['build_number']), r['mtime']),
+            reverse=True)
+
+    def duplicates(self, row):
+        '''Other archives with exactly the same content as row'''
+        return self.connection.execute(
+            'SELECT * FROM artifacts WHERE sha256 = ? AND path != ?', (row['sha256'], row['path'])).fetchall()
+
+    def latest(self, name, version=None, platform=None):
+        '''The newest archive still present on disk, or None'''
+        for row in self.query(name=name, version=version, platform=platform):
+            if Path(row['path']).exists():
+                return row
+        return None
+
+
+def _print_rows(rows, verbose):
+    for row in rows:
+        if verbose:
+            print(f'{row["path"]}\t{row["size"]}\tsha256:{row["sha256"]}\tprofile:{row["profile"]}\tinputs:{row["input_hash"]}')
+        else:
+            print(row['path'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Index and look up third party build archives')
+    parser.add_argument('--index', type=Path, default=None, help=f'database to use (default {default_index_path()})')
+    parser.add_argument('-v', '--verbose', action='store_true', help='show size, digest, profile and input hash')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add_parser = commands.add_parser('add', help='record archives')
+    add_parser.add_argument('archives', nargs='+', type=Path)
+    add_parser.add_argument('--profile', default=None)
+    add_parser.add_argument('--input-hash', default=None)
+
+    scan_parser = commands.add_parser('scan', help='record every archive in directories')
+    scan_parser.add_argument('directories', nargs='+', type=Path)
+
+    for command in ('latest', 'list'):
+        query_parser = commands.add_parser(command, help=f'{command} matching archives')
+        query_parser.add_argument('name', nargs='?' if command == 'list' else None)
+        query_parser.add_argument('version', nargs='?')
+        query_parser.add_argument('platform', nargs='?')
+        query_parser.add_argument('--input-hash', default=None)
+
+    args = parser.parse_args(argv)
+    with ArtifactIndex(args.index) as index:
+        if args.command == 'add':
+            _print_rows([index.add(a, profile=args.profile, input_hash=args.input_hash) for a in args.archives], args.verbose)
+        elif args.command == 'scan':
+            for directory in args.directories:
+                _print_rows(index.scan(directory), args.verbose)
+        elif args.command == 'list':
+            _print_rows(index.query(args.name, args.version, args.platform, input_hash=args.input_hash), args.verbose)
+        elif args.command == 'latest':
+            if args.input_hash is not None:
+                rows = index.query(args.name, args.version, args.platform, input_hash=args.input_hash)
+                row = next((r for r in rows if Path(r['path']).exists()), None)
+            else:
+                row = index.latest(args.name, args.version, args.platform)
+            if row is None:
+                return 1
+            _print_rows([row], args.verbose)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
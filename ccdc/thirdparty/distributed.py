@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+'''Dispatch Package builds to worker processes
+
+A worker listens on a TCP socket and builds one Package at a time. The
+coordinator sends each worker a job naming the recipe class (module:Class),
+optionally the input hash it expects and any environment overrides; the
+worker runs build() and streams back the archive produced by
+create_archive() with the input hash it built from. The coordinator stores
+the archive where create_archive() would have put it and records it in the
+artifact index, so downstream steps cannot tell a remote build from a local
+one.
+
+Workers import whatever recipe they are asked for, so only expose them on
+trusted networks (they listen on localhost unless told otherwise).
+
+    python -m ccdc.thirdparty.distributed worker --port 9123
+    python -m ccdc.thirdparty.distributed build --worker localhost:9123 mymodule:ZlibPackage
+    python -m ccdc.thirdparty.distributed build --local-workers 4 mymodule:ZlibPackage mymodule:Bzip2Package
+'''
+
+import sys
+import os
+import json
+import struct
+import socket
+import socketserver
+import subprocess
+import threading
+import queue
+import tempfile
+import hashlib
+import importlib
+import traceback
+import argparse
+from pathlib import Path
+
+from ccdc.thirdparty.artifacts import ArtifactIndex, file_sha256
+
+
+FORWARDED_ENVIRONMENT = ('BUILD_BUILDNUMBER', 'BUILD_VS_VERSION')
+
+_HEADER_LENGTH = struct.Struct('>I')
+_CHUNK_SIZE = 1024 * 1024
+
+
+class BuildJobError(Exception):
+    '''One or more dispatched builds failed'''
+    pass
+
+
+class _WorkerUnavailable(Exception):
+    '''The worker could not be reached, or went away mid-job'''
+    pass
+
+
+def _receive_exactly(connection, size):
+    data = bytearray()
+    while len(data) < size:
+        chunk = connection.recv(min(size - len(data), _CHUNK_SIZE))
+        if not chunk:
+            raise ConnectionError('Connection closed mid-message')
+        data.extend(chunk)
+    return bytes(data)
+
+
+def send_message(connection, header, payload_path=None):
+    '''Send a JSON header, followed by the content of payload_path if given'''
+    if payload_path is not None:
+        header = dict(header, size=os.path.getsize(payload_path))
+    encoded = json.dumps(header).encode('utf-8')
+    connection.sendall(_HEADER_LENGTH.pack(len(encoded)) + encoded)
+    if payload_path is not None:
+        with open(payload_path, 'rb') as f:
+            connection.sendfile(f)
+
+
+def receive_message(connection, payload_path=None):
+    '''Receive a JSON header, writing any payload that follows to payload_path'''
+    length, = _HEADER_LENGTH.unpack(_receive_exactly(connection, _HEADER_LENGTH.size))
+    header = json.loads(_receive_exactly(connection, length).decode('utf-8'))
+    if 'size' in header:
+        remaining = header['size']
+        digest = hashlib.sha256()
+        with open(payload_path, 'wb') as f:
+            while remaining:
+                chunk = connection.recv(min(remaining, _CHUNK_SIZE))
+                if not chunk:
+                    raise ConnectionError('Connection closed mid-payload')
+                digest.update(chunk)
+                f.write(chunk)
+                remaining -= len(chunk)
+        if 'sha256' in header and digest.hexdigest() != header['sha256']:
+            raise BuildJobError(f'Corrupt payload for {header.get("filename")}')
+    return header
+
+
+def recipe_name(package_class):
+    '''module:Class name a worker can import'''
+    module = package_class.__module__
+    if module == '__main__':
+        # a recipe defined in a script such as build_python.py is importable by the script's name
+        module = Path(sys.modules['__main__'].__file__).stem
+    return f'{module}:{package_class.__qualname__}'
+
+
+def load_recipe(recipe):
+    module_name, _, class_name = recipe.partition(':')
+    package_class = importlib.import_module(module_name)
+    for attribute in class_name.split('.'):
+        package_class = getattr(package_class, attribute)
+    return package_class
+
+
+class BuildJob(object):
+    '''A Package build to run on a worker'''
+
+    def __init__(self, recipe, input_hash=None, environment=None):
+        self.recipe = recipe
+        self.input_hash = input_hash
+        self.environment = dict(environment or {})
+
+    @classmethod
+    def for_package(cls, package_class, environment=None, input_hash=None):
+        '''Describe a build of package_class, forwarding the build number and Visual Studio version
+
+        The input hash covers the platform and SDK the package is built
+        against, so one computed here would make a worker on another host
+        reject the job. By default the job is not pinned and the worker
+        reports the hash of the inputs it actually built from, which is what
+        gets indexed; pass input_hash to insist on particular inputs.
+        '''
+        forwarded = {k: os.environ[k] for k in FORWARDED_ENVIRONMENT if k in os.environ}
+        forwarded.update(environment or {})
+        return cls(recipe_name(package_class), input_hash, forwarded)
+
+    def as_message(self):
+        return {
+            'type': 'build',
+            'recipe': self.recipe,
+            'input_hash': self.input_hash,
+            'environment': self.environment,
+        }
+
+    def __repr__(self):
+        return f'BuildJob({self.recipe})'
+
+
+def run_build_job(message):
+    '''Build the requested package in this process; return (reply header, archive path, staging directory)'''
+    staging = tempfile.TemporaryDirectory(prefix='ccdc-build-job-')
+    saved_environment = dict(os.environ)
+    try:
+        os.environ.update(message.get('environment', {}))
+        os.environ['BUILD_ARTIFACTSTAGINGDIRECTORY'] = staging.name
+        # the coordinator indexes the archive where it finally lands
+        os.environ['CCDC_ARTIFACT_INDEX'] = str(Path(staging.name) / 'artifacts.sqlite')
+        package = load_recipe(message['recipe'])()
+        if message.get('input_hash') and package.input_hash != message['input_hash']:
+            raise BuildJobError(f'{message["recipe"]} has input hash {package.input_hash} here, '
+                                f'coordinator expected {message["input_hash"]}')
+        package.build()
+        archive_path = Path(staging.name) / package.output_archive_filename
+        if not archive_path.exists():
+            raise BuildJobError(f'{message["recipe"]} did not produce {package.output_archive_filename}')
+        header = {
+            'status': 'ok',
+            'filename': archive_path.name,
+            'sha256': file_sha256(archive_path),
+            'profile': package.build_profile,
+            'input_hash': package.input_hash,
+        }
+        return header, archive_path, staging
+    except BaseException:
+        staging.cleanup()
+        raise
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_environment)
+
+
+class _WorkerHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        message = receive_message(self.request)
+        if message.get('type') != 'build':
+            send_message(self.request, {'status': 'error', 'message': f'Unknown request {message.get("type")}'})
+            return
+        print(f'Building {message["recipe"]} for {self.client_address[0]}')
+        sys.stdout.flush()
+        try:
+            header, archive_path, staging = run_build_job(message)
+        except Exception as e:
+            print(f'Failed to build {message["recipe"]}: {e}')
+            send_message(self.request, {'status': 'error', 'message': str(e), 'traceback': traceback.format_exc()})
+            return
+        with staging:
+            send_message(self.request, header, archive_path)
+        print(f'Sent {header["filename"]}')
+        sys.stdout.flush()
+
+
+def serve(host='localhost', port=0):
+    '''Run a worker until interrupted, building one job at a time'''
+    with socketserver.TCPServer((host, port), _WorkerHandler) as server:
+        host, port = server.server_address[:2]
+        print(f'Worker listening on {host}:{port}')
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+class LocalWorkers(object):
+    '''Start worker processes on this machine, as stand-ins for build agents'''
+
+    def __init__(self, count, host='localhost'):
+        self.count = count
+        self.host = host
+        self.processes = []
+        self.addresses = []
+
+    def _relay(self, number, stream):
+        for line in stream:
+            print(f'[worker {number}] {line.rstrip()}')
+
+    def __enter__(self):
+        for number in range(self.count):
+            process = subprocess.Popen(
+                [sys.executable, '-m', 'ccdc.thirdparty.distributed', 'worker', '--host', self.host, '--port', '0'],
+                stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+            self.processes.append(process)
+            first_line = process.stdout.readline()
+            if not first_line.startswith('Worker listening on '):
+                self.__exit__()
+                raise BuildJobError(f'Local worker failed to start: {first_line}{process.stdout.read()}')
+            host, _, port = first_line.split()[-1].rpartition(':')
+            self.addresses.append((host, int(port)))
+            threading.Thread(target=self._relay, args=(number, process.stdout), daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        for process in self.processes:
+            process.terminate()
+        for process in self.processes:
+            process.wait()
+
+
+class Coordinator(object):
+    '''Hand BuildJobs out to workers and collect their archives'''
+
+    def __init__(self, workers, output_directory=None, timeout=None):
+        self.workers = list(workers)
+        self.output_directory = Path(output_directory) if output_directory else self.default_output_directory()
+        self.timeout = timeout
+
+    @staticmethod
+    def default_output_directory():
+        '''Where create_archive() would have written the archives'''
+        from ccdc.thirdparty.package import Package
+        return Package().archive_output_directory
+
+    def _dispatch(self, address, job):
+        try:
+            connection = socket.create_connection(address, timeout=self.timeout)
+            # the timeout is only for reaching the worker: it says nothing until the build is done
+            connection.settimeout(None)
+        except OSError as e:
+            raise _WorkerUnavailable(e)
+        with connection:
+            descriptor, partial_name = tempfile.mkstemp(dir=self.output_directory, prefix='.incoming-')
+            os.close(descriptor)
+            try:
+                try:
+                    send_message(connection, job.as_message())
+                    reply = receive_message(connection, partial_name)
+                except (ConnectionError, TimeoutError) as e:
+                    raise _WorkerUnavailable(e)
+                if reply['status'] != 'ok':
+                    raise BuildJobError(f'{job.recipe} failed on {address[0]}:{address[1]}: {reply["message"]}\n{reply.get("traceback", "")}')
+                archive_path = self.output_directory / reply['filename']
+                # mkstemp creates private files; match what tar would have written
+                umask = os.umask(0)
+                os.umask(umask)
+                os.chmod(partial_name, 0o666 & ~umask)
+                os.replace(partial_name, archive_path)
+            finally:
+                if os.path.exists(partial_name):
+                    os.remove(partial_name)
+        with ArtifactIndex() as index:
+            index.add(archive_path, profile=reply['profile'], input_hash=reply['input_hash'])
+        return archive_path
+
+    def _settle(self, job, results, errors, archive_path=None, error=None):
+        with self._lock:
+            if error is None:
+                results[job.recipe] = archive_path
+            else:
+                errors[job.recipe] = error
+            self._unsettled -= 1
+
+    def _work(self, address, jobs, results, errors):
+        while self._unsettled:
+            try:
+                # another worker may still hand a job back, so keep polling until every job is settled
+                job = jobs.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            print(f'Dispatching {job.recipe} to {address[0]}:{address[1]}')
+            try:
+                archive_path = self._dispatch(address, job)
+            except _WorkerUnavailable as e:
+                # give the job to someone else and retire
+                print(f'Worker {address[0]}:{address[1]} unavailable ({e}), requeueing {job.recipe}')
+                jobs.put(job)
+                return
+            except BuildJobError as e:
+                self._settle(job, results, errors, error=str(e))
+            except Exception as e:
+                self._settle(job, results, errors, error=f'{type(e).__name__}: {e}\n{traceback.format_exc()}')
+            else:
+                self._settle(job, results, errors, archive_path=archive_path)
+                print(f'Received {archive_path.name} from {address[0]}:{address[1]}')
+
+    def run(self, jobs):
+        '''Build every job, returning a map of recipe to archive path'''
+        jobs = list(jobs)
+        recipes = [job.recipe for job in jobs]
+        duplicates = sorted({recipe for recipe in recipes if recipes.count(recipe) > 1})
+        if duplicates:
+            raise ValueError(f'Recipes requested more than once: {", ".join(duplicates)}')
+        self.output_directory.mkdir(parents=True, exist_ok=True)
+        pending = queue.Queue()
+        for job in jobs:
+            pending.put(job)
+        self._lock = threading.Lock()
+        self._unsettled = len(jobs)
+        results = {}
+        errors = {}
+        threads = [threading.Thread(target=self._work, args=(address, pending, results, errors)) for address in self.workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        while not pending.empty():
+            errors[pending.get().recipe] = 'no worker was available'
+        if errors:
+            raise BuildJobError('\n'.join(f'{recipe}: {message}' for recipe, message in errors.items()))
+        return results
+
+
+def _address(text):
+    host, _, port = text.rpartition(':')
+    return (host or 'localhost', int(port))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Distributed third party package builds')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    worker_parser = commands.add_parser('worker', help='build jobs sent by a coordinator')
+    worker_parser.add_argument('--host', default='localhost')
+    worker_parser.add_argument('--port', type=int, default=0)
+
+    build_parser = commands.add_parser('build', help='dispatch package builds to workers')
+    build_parser.add_argument('recipes', nargs='+', help='module:Class of each Package to build')
+    build_parser.add_argument('--worker', dest='workers', action='append', type=_address, default=[], help='host:port of a worker')
+    build_parser.add_argument('--local-workers', type=int, default=0, help='start this many workers on this machine')
+    build_parser.add_argument('--output-directory', type=Path, default=None)
+    build_parser.add_argument('--timeout', type=float, default=None, help='seconds to wait when connecting to a worker')
+
+    args = parser.parse_args(argv)
+    if args.command == 'worker':
+        serve(args.host, args.port)
+        return 0
+
+    jobs = [BuildJob.for_package(load_recipe(recipe)) for recipe in dict.fromkeys(args.recipes)]
+    with LocalWorkers(args.local_workers) as local_workers:
+        workers = args.workers + local_workers.addresses
+        if not workers:
+            parser.error('no workers: use --worker or --local-workers')
+        try:
+            results = Coordinator(workers, args.output_directory, args.timeout).run(jobs)
+        except BuildJobError as e:
+            print(e)
+            return 1
+    for recipe, archive_path in results.items():
+        print(f'{recipe}: {archive_path}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
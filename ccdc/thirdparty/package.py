@@ -8,8 +8,14 @@ import shutil
 import tempfile
 import multiprocessing
 import getpass
+import hashlib
+import json
 from pathlib import Path
 from distutils.version import StrictVersion
+from ccdc.thirdparty.artifacts import ArtifactIndex
+from ccdc.thirdparty.patching import patch_file, apply_unified_diff
+from ccdc.thirdparty import progress
+from ccdc.thirdparty.reproducible import reproducible_archives_requested, create_reproducible_archive
 
 
 class Package(object):
@@ -21,6 +27,7 @@ class Package(object):
     def __init__(self):
         self.use_vs_version_in_base_name = True
         self.use_distribution_in_base_name = False
+        self.use_reproducible_archive = reproducible_archives_requested()
 
     @property
     def macos(self):
@@ -156,13 +163,58 @@ class Package(object):
     def output_archive_filename(self):
         return f'{self.output_base_name}.tar.gz'
 
-    def create_archive(self):
+    @property
+    def archive_output_directory(self):
+        '''Return the directory where create_archive() leaves its output'''
         if 'BUILD_ARTIFACTSTAGINGDIRECTORY' in os.environ:
-            archive_output_directory = Path(
-                os.environ['BUILD_ARTIFACTSTAGINGDIRECTORY'])
-        else:
-            archive_output_directory = self.source_builds_base
+            return Path(os.environ['BUILD_ARTIFACTSTAGINGDIRECTORY'])
+        return self.source_builds_base
+
+    @property
+    def build_profile(self):
+        '''Short description of the toolchain choices baked into the archive'''
+        components = ['release']
+        if self.macos:
+            components.append(f'macos{self.macos_deployment_target}')
+        if self.windows and 'BUILD_VS_VERSION' in os.environ:
+            components.append(f'vs{os.environ["BUILD_VS_VERSION"]}')
+        return '-'.join(components)
+
+    @property
+    def input_hash(self):
+        '''Digest of everything that determines what the build produces'''
+        inputs = {
+            'class': f'{type(self).__module__}.{type(self).__qualname__}',
+            'name': self.name,
+            'version': self.version,
+            'platform': self.platform,
+            'profile': self.build_profile,
+            'source_archives': self.source_archives,
+            'arguments_to_configuration_script': [str(a) for a in self.arguments_to_configuration_script],
+            'cflags': self.cflags,
+            'cxxflags': self.cxxflags,
+            'ldflags': self.ldflags,
+        }
+        return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def index_archive(self, archive_path):
+        '''Record a freshly created archive in the local artifact index'''
+        with ArtifactIndex() as index:
+            row = index.add(archive_path, profile=self.build_profile, input_hash=self.input_hash)
+            for duplicate in index.duplicates(row):
+                print(f'{archive_path.name} is identical to {duplicate["path"]}')
+        print(f'Indexed {archive_path}')
+
+    def create_archive(self):
+        archive_output_directory = self.archive_output_directory
         print(f'Creating {self.output_archive_filename} in {archive_output_directory}')
+        if self.use_reproducible_archive:
+            create_reproducible_archive(
+                self.toolbase / self.name,
+                self.install_directory.relative_to(self.toolbase / self.name),
+                archive_output_directory / self.output_archive_filename)
+            self.index_archive(archive_output_directory / self.output_archive_filename)
+            return
         command = [
             'tar',
             '-zcf',
@@ -178,6 +230,7 @@ class Package(object):
             command.insert(1, '--force-local')
             # keep the name + version directory in the archive, but not the package name directory
             self.system(command, cwd=self.toolbase / self.name)
+        self.index_archive(archive_output_directory / self.output_archive_filename)
 
     @property
     def include_directories(self):
@@ -363,31 +416,21 @@ class Package(object):
         '''Canonical log file for a particular task'''
         return self.build_logs / f'{self.name}-{self.version}-{task}.log'
 
+    @property
+    def phase_timings_path(self):
+        '''Return the file recording how long each build phase usually takes'''
+        return self.build_logs / progress.TIMINGS_FILENAME
+
     def system(self, command, cwd=None, env=None, append_log=False):
         '''execute command, logging in the appropriate logfile'''
         task = sys._getframe(1).f_code.co_name
-        print(f'{self.name} {task}')
+        progress.reporter().message(f'{self.name} {task}')
         if isinstance(command, str):
             command = [command]
-        print(f'Running {command}')
-        openmode = 'a' if append_log else 'w'
-        with open(self.logfile_path(task), openmode) as f:
-            output = ''
-            p = subprocess.Popen(
-                command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd, env=env)
-            while True:
-                retcode = p.poll()
-                l = p.stdout.readline().decode('utf-8')
-                print(l.rstrip())
-                output += l
-                f.write(l)
-                if retcode is not None:
-                    break
-            assert p.returncode is not None
-            if p.returncode != 0:
-                print(f'Failed process environment was {env}')
-                raise subprocess.CalledProcessError(
-                    returncode=p.returncode, cmd=command, output=output)
+        progress.reporter().message(f'Running {command}')
+        progress.run_logged(
+            command, f'{self.name} {task}', f'{self.name}-{self.version}:{task}', self.phase_timings_path,
+            self.logfile_path(task), cwd=cwd, env=env, append_log=append_log)
 
     def verify(self):
         '''Override this function to verify that the install has
@@ -415,12 +458,30 @@ class Package(object):
                      from_path, to_path, str(library_path)])
 
     def patch(self, fname, *subs):
-        with open(fname) as read_file:
-            txt = read_file.read()
-        for (old, new) in subs:
-            txt = txt.replace(old, new)
-        with open(fname, 'w') as out:
-            out.write(txt)
+        '''Apply literal (old, new) substitutions to a file in a single pass
+
+        Every substitution is matched against the original text, leftmost
+        match first and the longest one where several start at the same
+        place, and replaced text is never rescanned. This is not the same as
+        applying them one after another: ('foo', 'bar'), ('bar', 'baz') turns
+        'foo bar' into 'bar baz', not 'baz baz', and ('a', 'b'), ('ab', 'X')
+        turns 'ab' into 'X', not 'bb'. Call patch() twice where one
+        substitution must see the output of another.
+
+        The file is only rewritten when its content changes, so make does not
+        rebuild what depends on it. Returns the substitutions that never matched.
+        '''
+        unmatched = patch_file(fname, subs)
+        for (old, new) in unmatched:
+            print(f'Warning: {fname}: substitution of {old!r} never matched')
+        return unmatched
+
+    def apply_patch(self, patch_path, strip=1, directory=None):
+        '''Apply a unified diff, by default to the main source directory'''
+        if directory is None:
+            directory = self.main_source_directory_path
+        print(f'Applying {patch_path} to {directory}')
+        return apply_unified_diff(patch_path, directory, strip=strip)
 
 
 _pkg = Package()
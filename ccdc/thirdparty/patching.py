@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+'''Source patching without holding several copies of a file in memory
+
+MultiReplacer applies any number of literal substitutions in one pass over
+a stream (an Aho-Corasick automaton), and apply_unified_diff() applies a
+unified diff in-process so we do not depend on an external patch tool.
+Files are only rewritten, atomically, when their content really changes,
+so untouched sources keep their mtimes and make does not rebuild them.
+'''
+
+import os
+import re
+import datetime
+import shutil
+import tempfile
+from collections import deque
+from pathlib import Path
+
+
+class PatchError(Exception):
+    '''A patch could not be applied'''
+    pass
+
+
+class MultiReplacer(object):
+    '''Replace several literal strings in a single pass
+
+    Matches are chosen leftmost first and, at the same position, longest
+    first; replaced text is never rescanned. When the same string appears
+    twice in subs the first replacement wins, as it would have with
+    successive str.replace calls.
+    '''
+
+    def __init__(self, subs):
+        self.subs = list(subs)
+        self._goto = [{}]
+        self._fail = [0]
+        self._depth = [0]
+        self._output = [None]
+        for index, (old, new) in enumerate(self.subs):
+            if not old:
+                raise ValueError('Cannot substitute an empty string')
+            state = 0
+            for c in old:
+                if c not in self._goto[state]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._depth.append(self._depth[state] + 1)
+                    self._output.append(None)
+                    self._goto[state][c] = len(self._goto) - 1
+                state = self._goto[state][c]
+            if self._output[state] is None:
+                self._output[state] = index
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for c, child in self._goto[state].items():
+                queue.append(child)
+                fallback = self._fail[state]
+                while fallback and c not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(c, 0)
+                if self._output[child] is None:
+                    # the longest pattern ending here is the longest one ending at the fallback
+                    self._output[child] = self._output[self._fail[child]]
+        self.reset()
+
+    def reset(self):
+        '''Forget any partially processed stream and the match counts'''
+        self.counts = [0] * len(self.subs)
+        self._pending = ''
+        self._position = 0
+        self._state = 0
+        self._candidate = None
+
+    @property
+    def unmatched(self):
+        '''Substitutions that never matched since the last reset'''
+        return [sub for sub, count in zip(self.subs, self.counts) if count == 0]
+
+    @property
+    def changed(self):
+        '''True if any applied substitution altered the text'''
+        return any(count and old != new for (old, new), count in zip(self.subs, self.counts))
+
+    def _step(self, c):
+        state = self._state
+        while state and c not in self._goto[state]:
+            state = self._fail[state]
+        self._state = self._goto[state].get(c, 0)
+
+    def _scan(self, final):
+        out = []
+        pending = self._pending
+        # pending[:emitted] is already in out; slice the buffer once at the end rather than after every match
+        emitted = 0
+        while True:
+            while self._position < len(pending):
+                self._step(pending[self._position])
+                self._position += 1
+                match = self._output[self._state]
+                if match is not None:
+                    start = self._position - len(self.subs[match][0])
+                    if self._candidate is None or start <= self._candidate[0]:
+                        self._candidate = (start, self._position, match)
+                earliest_possible_start = self._position - self._depth[self._state]
+                if self._candidate is not None and earliest_possible_start > self._candidate[0]:
+                    break
+            if self._candidate is not None and (final or self._position - self._depth[self._state] > self._candidate[0]):
+                start, end, match = self._candidate
+                out.append(pending[emitted:start])
+                out.append(self.subs[match][1])
+                self.counts[match] += 1
+                # resume just after the replaced text, rescanning what we had read ahead
+                emitted = end
+                self._position = end
+                self._state = 0
+                self._candidate = None
+                continue
+            if self._candidate is None:
+                # nothing before the start of the current partial match can be part of a match
+                keep_from = len(pending) if final else self._position - self._depth[self._state]
+                out.append(pending[emitted:keep_from])
+                emitted = keep_from
+            break
+        self._pending = pending[emitted:]
+        self._position -= emitted
+        if self._candidate is not None:
+            start, end, match = self._candidate
+            self._candidate = (start - emitted, end - emitted, match)
+        return ''.join(out)
+
+    def feed(self, text):
+        '''Process the next chunk of a stream, returning whatever output is settled'''
+        self._pending += text
+        return self._scan(final=False)
+
+    def finish(self):
+        '''Flush the end of the stream'''
+        return self._scan(final=True)
+
+    def replace(self, text):
+        '''Apply the substitutions to a whole string'''
+        self.reset()
+        return self.feed(text) + self.finish()
+
+
+def _atomic_replace_from(temporary_path, destination):
+    if Path(destination).exists():
+        shutil.copymode(destination, temporary_path)
+    else:
+        # mkstemp creates private files; give new ones the mode patch would have
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary_path, 0o666 & ~umask)
+    os.replace(temporary_path, destination)
+
+
+def patch_file(fname, subs, chunk_size=64 * 1024):
+    '''Stream fname through a MultiReplacer, rewriting it only if it changes
+
+    Returns the substitutions that never matched.
+    '''
+    fname = Path(fname)
+    replacer = MultiReplacer(subs)
+    descriptor, temporary_name = tempfile.mkstemp(dir=fname.parent, prefix=f'.{fname.name}.')
+    try:
+        with open(fname) as read_file, os.fdopen(descriptor, 'w') as out:
+            for chunk in iter(lambda: read_file.read(chunk_size), ''):
+                out.write(replacer.feed(chunk))
+            out.write(replacer.finish())
+        if replacer.changed:
+            _atomic_replace_from(temporary_name, fname)
+    finally:
+        if os.path.exists(temporary_name):
+            os.remove(temporary_name)
+    return replacer.unmatched
+
+
+_HUNK_HEADER = re.compile(r'@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+_TIMESTAMP = re.compile(r'(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d)(?:\.\d+)?(?: ([+-]\d{4}))?')
+
+
+def _is_epoch_timestamp(header):
+    '''diff -N dates the missing side of a created or deleted file at the epoch (in local time)'''
+    _, _, timestamp = header.partition('\t')
+    match = _TIMESTAMP.match(timestamp.strip())
+    if not match:
+        return False
+    when = datetime.datetime.strptime(match.group(1), '%Y-%m-%d %H:%M:%S')
+    if match.group(2):
+        sign = -1 if match.group(2)[0] == '-' else 1
+        when -= sign * datetime.timedelta(hours=int(match.group(2)[1:3]), minutes=int(match.group(2)[3:]))
+    return when == datetime.datetime(1970, 1, 1)
+
+
+class _FilePatch(object):
+    def __init__(self, old_name, new_name, marked_deleted=False):
+        self.old_name = old_name
+        self.new_name = new_name
+        self.marked_deleted = marked_deleted
+        self.hunks = []
+
+    @property
+    def creates(self):
+        '''diff -N writes new files against an empty file at line 0 rather than /dev/null'''
+        return self.old_name is None or all(old_start == 0 and not old_lines for old_start, _, old_lines, _ in self.hunks)
+
+    @property
+    def deletes(self):
+        '''Only an explicit /dev/null or epoch-dated new file deletes; emptying a file does not'''
+        return self.new_name is None or self.marked_deleted
+
+
+def _strip_path(name, strip):
+    name = name.split('\t')[0].strip()
+    if name == '/dev/null':
+        return None
+    parts = Path(name).parts
+    if len(parts) <= strip:
+        raise PatchError(f'Cannot strip {strip} components from {name}')
+    return Path(*parts[strip:])
+
+
+def parse_unified_diff(lines, strip=1):
+    '''Parse the lines of a unified diff into a list of per-file patches'''
+    patches = []
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith('--- ') and i + 1 < len(lines) and lines[i + 1].startswith('+++ '):
+            patches.append(_FilePatch(_strip_path(line[4:], strip), _strip_path(lines[i + 1][4:], strip),
+                                      marked_deleted=_is_epoch_timestamp(lines[i + 1][4:])))
+            i += 2
+            continue
+        header = _HUNK_HEADER.match(line)
+        if header:
+            if not patches:
+                raise PatchError(f'Hunk without file header at line {i + 1}')
+            old_count = int(header.group(2)) if header.group(2) is not None else 1
+            new_count = int(header.group(4)) if header.group(4) is not None else 1
+            old_lines = []
+            new_lines = []
+            last_kind = None
+            i += 1
+            while i < len(lines) and (len(old_lines) < old_count or len(new_lines) < new_count or lines[i].startswith('\\')):
+                body = lines[i]
+                if body.startswith('\\'):
+                    # "\ No newline at end of file" applies to the previous line
+                    if last_kind in ('-', ' '):
+                        old_lines[-1] = old_lines[-1].rstrip('\r\n')
+                    if last_kind in ('+', ' '):
+                        new_lines[-1] = new_lines[-1].rstrip('\r\n')
+                elif body.startswith('-'):
+                    old_lines.append(body[1:])
+                elif body.startswith('+'):
+                    new_lines.append(body[1:])
+                elif body.startswith(' ') or body == '\n':
+                    old_lines.append(body[1:] if body.startswith(' ') else body)
+                    new_lines.append(body[1:] if body.startswith(' ') else body)
+                else:
+                    raise PatchError(f'Unexpected line {i + 1} in hunk: {body!r}')
+                last_kind = body[0] if body[0] in '-+\\' else ' '
+                i += 1
+            patches[-1].hunks.append((int(header.group(1)), int(header.group(3)), old_lines, new_lines))
+            continue
+        i += 1
+    return patches
+
+
+def _find_hunk(lines, old_lines, expected, after):
+    '''Find where a hunk's old lines occur, searching outward from the expected line'''
+    if not old_lines:
+        return max(expected, after)
+    last_start = len(lines) - len(old_lines)
+    for offset in range(0, max(last_start, 0) + len(lines) + 1):
+        for start in (expected + offset, expected - offset):
+            if after <= start <= last_start and lines[start:start + len(old_lines)] == old_lines:
+                return start
+    return None
+
+
+def apply_unified_diff(patch_path, directory, strip=1):
+    '''Apply a unified diff to the files under directory
+
+    Every hunk is checked before anything is written, so a patch that does
+    not apply leaves the tree untouched. Returns the files that changed.
+    '''
+    directory = Path(directory)
+    with open(patch_path) as f:
+        patches = parse_unified_diff(f.read().splitlines(keepends=True), strip=strip)
+    results = []
+    for file_patch in patches:
+        target = file_patch.new_name or file_patch.old_name
+        source = file_patch.old_name or file_patch.new_name
+        if (directory / source).exists():
+            with open(directory / source) as f:
+                original = f.readlines()
+        elif file_patch.creates:
+            original = []
+        else:
+            raise PatchError(f'{directory / source} does not exist')
+        lines = list(original)
+        delta = 0
+        after = 0
+        for hunk_number, (old_start, _, old_lines, new_lines) in enumerate(file_patch.hunks, 1):
+            expected = max(old_start - 1, 0) + delta
+            start = _find_hunk(lines, old_lines, expected, after)
+            if start is None:
+                raise PatchError(f'Hunk #{hunk_number} of {target} in {patch_path} does not apply')
+            lines[start:start + len(old_lines)] = new_lines
+            delta += len(new_lines) - len(old_lines)
+            after = start + len(new_lines)
+        results.append((file_patch, target, original, lines))
+    changed = []
+    for file_patch, target, original, lines in results:
+        if file_patch.deletes and not lines:
+            if (directory / target).exists():
+                os.remove(directory / target)
+                changed.append(directory / target)
+        elif lines != original or not (directory / target).exists():
+            if write_if_changed(directory / target, ''.join(lines)):
+                changed.append(directory / target)
+    return changed
+
+
+def write_if_changed(fname, text):
+    '''Atomically replace fname with text unless it already holds exactly that'''
+    fname = Path(fname)
+    if fname.exists():
+        with open(fname) as f:
+            if f.read() == text:
+                return False
+    fname.parent.mkdir(parents=True, exist_ok=True)
+    descriptor, temporary_name = tempfile.mkstemp(dir=fname.parent, prefix=f'.{fname.name}.')
+    try:
+        with os.fdopen(descriptor, 'w') as out:
+            out.write(text)
+        _atomic_replace_from(temporary_name, fname)
+    finally:
+        if os.path.exists(temporary_name):
+            os.remove(temporary_name)
+    return True
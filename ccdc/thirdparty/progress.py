@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+'''Progress, ETA and stall warnings for long running build commands
+
+Every command run through run_logged() is a phase (e.g. "sqlite
+run_build_command"). How long each phase took is kept in a small JSON file
+next to the build logs, and the median of recent runs is used as the
+estimate next time.
+
+On an interactive terminal the raw command output only goes to the log and
+each running phase gets one status line, redrawn every second. In CI (or
+when stdout is not a terminal) the raw output is printed as before and a
+summary line per phase is printed every minute. Either way a warning is
+printed when a phase runs far longer than it usually does.
+
+CCDC_BUILD_PROGRESS=tty|ci|off overrides the choice of display.
+'''
+
+import sys
+import os
+import json
+import time
+import shutil
+import tempfile
+import threading
+import statistics
+import subprocess
+from contextlib import contextmanager
+from pathlib import Path
+
+
+TIMINGS_FILENAME = 'phase_timings.json'
+HISTORY_LENGTH = 10
+SLOW_FACTOR = 2.0
+SLOW_MINIMUM_SECONDS = 60
+TTY_INTERVAL = 1
+CI_INTERVAL = 60
+FAILURE_TAIL_LINES = 40
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f'{seconds // 3600}h{seconds % 3600 // 60:02d}m'
+    if seconds >= 60:
+        return f'{seconds // 60}m{seconds % 60:02d}s'
+    return f'{seconds}s'
+
+
+def progress_mode():
+    '''tty, ci or off'''
+    mode = os.environ.get('CCDC_BUILD_PROGRESS')
+    if mode in ('tty', 'ci', 'off'):
+        return mode
+    if sys.stdout.isatty() and 'CI' not in os.environ and 'TF_BUILD' not in os.environ:
+        return 'tty'
+    return 'ci'
+
+
+class PhaseTimings(object):
+    '''Durations of recent successful runs of each phase'''
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def estimate(self, key):
+        '''Median of the recorded durations, or None without history'''
+        history = self.load().get(key)
+        return statistics.median(history) if history else None
+
+    def record(self, key, seconds):
+        timings = self.load()
+        timings[key] = (timings.get(key, []) + [round(seconds, 1)])[-HISTORY_LENGTH:]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        descriptor, temporary_name = tempfile.mkstemp(dir=self.path.parent, prefix=f'.{self.path.name}.')
+        try:
+            with os.fdopen(descriptor, 'w') as f:
+                json.dump(timings, f, indent=1, sort_keys=True)
+            os.replace(temporary_name, self.path)
+        finally:
+            if os.path.exists(temporary_name):
+                os.remove(temporary_name)
+
+
+class Phase(object):
+    '''A running command, as shown by the reporter'''
+
+    def __init__(self, label, estimate):
+        self.label = label
+        self.estimate = estimate
+        self.started = time.monotonic()
+        self.lines = 0
+        self.last_line = ''
+        self.tail = []
+        self.slow_reported = False
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def slow(self):
+        return (self.estimate is not None and self.elapsed > SLOW_MINIMUM_SECONDS
+                and self.elapsed > SLOW_FACTOR * self.estimate)
+
+    def status(self):
+        elapsed = self.elapsed
+        if self.estimate is None:
+            timing = f'{format_duration(elapsed)} (no history)'
+        elif elapsed <= self.estimate:
+            timing = (f'{format_duration(elapsed)} of ~{format_duration(self.estimate)} '
+                      f'({int(100 * elapsed / max(self.estimate, 1))}%, eta {format_duration(self.estimate - elapsed)})')
+        else:
+            timing = f'{format_duration(elapsed)}, over the usual ~{format_duration(self.estimate)}'
+        status = f'{self.label}: {timing}, {self.lines} lines'
+        if self.slow:
+            status += ' SLOW'
+        return status
+
+
+class ProgressReporter(object):
+    '''Shows the state of every running phase'''
+
+    def __init__(self, mode=None, stream=None):
+        self.mode = mode or progress_mode()
+        self.stream = stream or sys.stdout
+        self.interval = TTY_INTERVAL if self.mode == 'tty' else CI_INTERVAL
+        self.phases = []
+        self._lock = threading.RLock()
+        self._drawn = 0
+        self._ticker = None
+
+    def _clear(self):
+        if self._drawn:
+            # back to the first status line, then erase to the end of the screen
+            self.stream.write(f'\x1b[{self._drawn}F\x1b[J')
+            self._drawn = 0
+
+    def _draw(self):
+        width = shutil.get_terminal_size().columns - 1
+        for phase in self.phases:
+            line = phase.status()
+            if phase.last_line:
+                line += f' | {phase.last_line}'
+            self.stream.write(line[:width] + '\n')
+        self._drawn = len(self.phases)
+        self.stream.flush()
+
+    def message(self, text):
+        '''Print a line without disturbing the status lines'''
+        with self._lock:
+            if self.mode == 'tty':
+                self._clear()
+                self.stream.write(f'{text}\n')
+                self._draw()
+            else:
+                self.stream.write(f'{text}\n')
+                self.stream.flush()
+
+    def output(self, phase, line):
+        '''A line of raw output from the command behind phase'''
+        phase.lines += 1
+        phase.tail = (phase.tail + [line])[-FAILURE_TAIL_LINES:]
+        if self.mode == 'tty':
+            phase.last_line = line.strip()
+        else:
+            with self._lock:
+                self.stream.write(f'{line}\n')
+
+    def _check_slow(self):
+        for phase in self.phases:
+            if phase.slow and not phase.slow_reported:
+                phase.slow_reported = True
+                self.message(f'WARNING: {phase.label} has been running for {format_duration(phase.elapsed)}, '
+                             f'over {SLOW_FACTOR:g}x its usual {format_duration(phase.estimate)}; the agent may be stalled or throttled')
+
+    def tick(self):
+        with self._lock:
+            if not self.phases:
+                return
+            self._check_slow()
+            if self.mode == 'tty':
+                self._clear()
+                self._draw()
+            elif self.mode == 'ci':
+                for phase in self.phases:
+                    self.message(f'[progress] {phase.status()}')
+
+    def _run_ticker(self):
+        while True:
+            time.sleep(self.interval)
+            self.tick()
+
+    @contextmanager
+    def phase(self, label, key, timings_path):
+        '''Track a phase, recording its duration in timings_path if it succeeds'''
+        timings = PhaseTimings(timings_path)
+        phase = Phase(label, timings.estimate(key))
+        with self._lock:
+            self.phases.append(phase)
+            if self._ticker is None and self.mode != 'off':
+                self._ticker = threading.Thread(target=self._run_ticker, daemon=True)
+                self._ticker.start()
+            if self.mode == 'tty':
+                self._clear()
+                self._draw()
+        try:
+            yield phase
+        except BaseException:
+            with self._lock:
+                self.phases.remove(phase)
+                if self.mode == 'tty':
+                    # the raw output was only logged, so show how it ended
+                    self._clear()
+                    self.stream.write(f'{phase.label} failed after {format_duration(phase.elapsed)}; last output:\n')
+                    self.stream.write(''.join(f'    {line}\n' for line in phase.tail))
+                    self._draw()
+            raise
+        with self._lock:
+            self.phases.remove(phase)
+            if self.mode == 'tty':
+                self._clear()
+                self.stream.write(f'{phase.label} finished in {format_duration(phase.elapsed)}\n')
+                self._draw()
+        timings.record(key, phase.elapsed)
+
+
+_reporter = None
+
+
+def reporter():
+    '''The reporter shared by every build in this process'''
+    global _reporter
+    if _reporter is None:
+        _reporter = ProgressReporter()
+    return _reporter
+
+
+def run_logged(command, label, key, timings_path, log_path, cwd=None, env=None, append_log=False, shell=False):
+    '''execute command, logging its output in log_path and reporting its progress'''
+    openmode = 'a' if append_log else 'w'
+    with open(log_path, openmode) as f, reporter().phase(label, key, timings_path) as phase:
+        output = ''
+        p = subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=cwd, env=env, shell=shell)
+        # read to the end of the output, not just until the process exits, so no trailing lines are lost
+        for raw_line in iter(p.stdout.readline, b''):
+            line = raw_line.decode('utf-8')
+            reporter().output(phase, line.rstrip())
+            output += line
+            f.write(line)
+        p.wait()
+        if p.returncode != 0:
+            reporter().message(f'Failed process environment was {env}')
+            raise subprocess.CalledProcessError(
+                returncode=p.returncode, cmd=command, output=output)
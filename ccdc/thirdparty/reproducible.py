@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+'''Byte-for-byte reproducible archives
+
+Two archives of the same tree made by tar differ because of file mtimes,
+owners, directory listing order and the timestamp in the gzip header.
+create_reproducible_archive() normalises all of those so identical inputs
+give identical artifacts, which can then be deduplicated by digest.
+See https://reproducible-builds.org/docs/source-date-epoch/
+'''
+
+import os
+import stat
+import gzip
+import tarfile
+import tempfile
+import subprocess
+from pathlib import Path
+
+
+def reproducible_archives_requested():
+    '''Deterministic archives are made whenever SOURCE_DATE_EPOCH is set'''
+    return 'SOURCE_DATE_EPOCH' in os.environ
+
+
+def source_date_epoch():
+    '''The timestamp no archived file may be newer than'''
+    return int(os.environ.get('SOURCE_DATE_EPOCH', '0'))
+
+
+def _walk(path):
+    yield path
+    if path.is_dir() and not path.is_symlink():
+        for child in sorted(os.listdir(path)):
+            yield from _walk(path / child)
+
+
+def _normalise(tarinfo, epoch):
+    tarinfo.uid = tarinfo.gid = 0
+    tarinfo.uname = tarinfo.gname = ''
+    tarinfo.mtime = min(int(tarinfo.mtime), epoch)
+    if tarinfo.issym():
+        tarinfo.mode = 0o777
+    elif tarinfo.isdir() or tarinfo.mode & stat.S_IXUSR:
+        tarinfo.mode = 0o755
+    else:
+        tarinfo.mode = 0o644
+    return tarinfo
+
+
+def create_reproducible_archive(base_directory, member, output_path, epoch=None):
+    '''Write base_directory/member, and everything below it, to a .tar.gz
+
+    Entries are sorted, owned by 0:0 with no user or group names, have
+    normalised permissions and mtimes clamped to epoch (SOURCE_DATE_EPOCH by
+    default), and the gzip header carries no name or timestamp.
+    '''
+    base_directory = Path(base_directory)
+    output_path = Path(output_path)
+    if epoch is None:
+        epoch = source_date_epoch()
+    descriptor, temporary_name = tempfile.mkstemp(dir=output_path.parent, prefix=f'.{output_path.name}.')
+    try:
+        with os.fdopen(descriptor, 'wb') as raw, \
+                gzip.GzipFile(filename='', mode='wb', fileobj=raw, mtime=0) as compressed, \
+                tarfile.open(fileobj=compressed, mode='w', format=tarfile.GNU_FORMAT) as archive:
+            for path in _walk(base_directory / member):
+                tarinfo = _normalise(archive.gettarinfo(str(path), arcname=path.relative_to(base_directory).as_posix()), epoch)
+                if tarinfo.isreg():
+                    with open(path, 'rb') as f:
+                        archive.addfile(tarinfo, f)
+                else:
+                    archive.addfile(tarinfo)
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temporary_name, 0o666 & ~umask)
+        os.replace(temporary_name, output_path)
+    finally:
+        if os.path.exists(temporary_name):
+            os.remove(temporary_name)
+
+
+# the test fixtures CPython's own "make install" leaves out because they are deliberately invalid
+INVALID_PYTHON_FIXTURES = r'bad_coding|badsyntax|lib2to3[/\\]tests[/\\]data'
+
+
+def compile_checked_hash_pycs(interpreter, directory, sudo=False):
+    '''Recompile every .py under directory so its .pyc is validated by source hash, not mtime
+
+    Use sudo when directory is owned by root and the build runs as another user.
+    '''
+    print(f'Compiling checked-hash .pyc files in {directory}')
+    command = [str(interpreter), '-m', 'compileall', '-q', '-f', '-j', '0',
+               '--invalidation-mode', 'checked-hash', '-o', '0', '-o', '1', '-o', '2',
+               '-x', INVALID_PYTHON_FIXTURES, str(directory)]
+    if sudo:
+        command.insert(0, 'sudo')
+    subprocess.run(command, check=True)
@@ -0,0 +1,41 @@
+'''Minimal recipes for exercising distributed builds without compiling anything'''
+
+import os
+import time
+import tarfile
+from pathlib import Path
+
+
+class QuickRecipe(object):
+    name = 'quick'
+    build_seconds = 0
+    input_hash = 'test-inputs'
+    build_profile = 'release'
+
+    @property
+    def output_archive_filename(self):
+        return f'{self.name}-1.0-1-linux.tar.gz'
+
+    def build(self):
+        time.sleep(self.build_seconds)
+        staging = Path(os.environ['BUILD_ARTIFACTSTAGINGDIRECTORY'])
+        content = staging / self.name
+        content.write_text(self.name)
+        with tarfile.open(staging / self.output_archive_filename, 'w:gz') as archive:
+            archive.add(content, arcname=self.name)
+
+
+class OtherRecipe(QuickRecipe):
+    name = 'other'
+
+
+class SlowRecipe(QuickRecipe):
+    name = 'slow'
+    build_seconds = 2
+
+
+class BrokenRecipe(QuickRecipe):
+    name = 'broken'
+
+    def build(self):
+        raise RuntimeError('kaboom')
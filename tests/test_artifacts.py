@@ -0,0 +1,112 @@
+import os
+
+import pytest
+
+from ccdc.thirdparty import artifacts
+from ccdc.thirdparty.artifacts import ArtifactIndex, parse_archive_filename
+
+
+@pytest.fixture
+def index(tmp_path):
+    with ArtifactIndex(tmp_path / 'artifacts.sqlite') as index:
+        yield index
+
+
+def make_archive(directory, filename, content=None):
+    path = directory / filename
+    path.write_bytes((content or filename).encode('utf-8'))
+    return path
+
+
+def test_parse_numbered_build():
+    assert parse_archive_filename('base_python-3.11.6-12-ubuntu22.04.tar.gz') == {
+        'name': 'base_python', 'version': '3.11.6', 'build_number': '12', 'platform': 'ubuntu22.04', 'vs_version': None}
+
+
+def test_parse_dashed_developer_build_number():
+    parsed = parse_archive_filename('sqlite-3.45.0-do-not-use-me-developer-version-linux.tar.gz')
+    assert parsed['build_number'] == 'do-not-use-me-developer-version'
+    assert parsed['platform'] == 'linux'
+
+
+def test_parse_visual_studio_suffix():
+    parsed = parse_archive_filename('zlib-1.2.13-7-win32-vs2019.tar.gz')
+    assert parsed['platform'] == 'win32'
+    assert parsed['vs_version'] == '2019'
+    assert parsed['build_number'] == '7'
+
+
+def test_parse_rejects_other_files():
+    assert parse_archive_filename('notes.txt') is None
+    assert parse_archive_filename('too-short.tar.gz') is None
+
+
+def test_version_prefix_matches_on_dot_boundary(index, tmp_path):
+    index.add(make_archive(tmp_path, 'base_python-3.11.6-1-linux.tar.gz'))
+    index.add(make_archive(tmp_path, 'base_python-3.110.0-1-linux.tar.gz'))
+    assert [r['version'] for r in index.query('base_python', '3.11')] == ['3.11.6']
+    assert [r['version'] for r in index.query('base_python', '3.110')] == ['3.110.0']
+
+
+def test_version_is_compared_literally(index, tmp_path):
+    index.add(make_archive(tmp_path, 'base_python-3.11.6-1-linux.tar.gz'))
+    index.add(make_archive(tmp_path, 'tool-1a2.0-1-linux.tar.gz'))
+    assert index.query('base_python', '3_11') == []
+    assert index.query('base_python', '3.%') == []
+    assert index.query('tool', '1A2') == []
+    assert len(index.query('tool', '1a2')) == 1
+
+
+def test_latest_prefers_newer_versions_and_numbered_builds(index, tmp_path):
+    for filename in ('base_python-3.11.6-12-linux.tar.gz',
+                     'base_python-3.11.6-14-linux.tar.gz',
+                     'base_python-3.11.6-dont-use-me-dev-build-linux.tar.gz',
+                     'base_python-3.11.10-2-linux.tar.gz',
+                     'base_python-3.11.99-1-win32.tar.gz'):
+        index.add(make_archive(tmp_path, filename))
+    assert index.latest('base_python', '3.11', 'linux')['filename'] == 'base_python-3.11.10-2-linux.tar.gz'
+    assert index.latest('base_python', '3.11.6', 'linux')['filename'] == 'base_python-3.11.6-14-linux.tar.gz'
+
+
+def test_latest_skips_archives_missing_on_disk(index, tmp_path):
+    index.add(make_archive(tmp_path, 'base_python-3.11.6-12-linux.tar.gz'))
+    newest = make_archive(tmp_path, 'base_python-3.11.6-14-linux.tar.gz')
+    index.add(newest)
+    newest.unlink()
+    assert index.latest('base_python', '3.11', 'linux')['filename'] == 'base_python-3.11.6-12-linux.tar.gz'
+    # still indexed, just not offered
+    assert newest.name in [r['filename'] for r in index.query('base_python')]
+
+
+def test_scan_forgets_deleted_archives(index, tmp_path):
+    kept = make_archive(tmp_path, 'sqlite-3.45.0-1-linux.tar.gz')
+    deleted = make_archive(tmp_path, 'sqlite-3.45.0-2-linux.tar.gz')
+    make_archive(tmp_path, 'README.tar.gz')
+    assert len(index.scan(tmp_path)) == 2
+    deleted.unlink()
+    index.scan(tmp_path)
+    assert [r['filename'] for r in index.query('sqlite')] == [kept.name]
+
+
+def test_add_reuses_digest_when_unchanged(index, tmp_path, monkeypatch):
+    archive = make_archive(tmp_path, 'sqlite-3.45.0-1-linux.tar.gz')
+    first = index.add(archive, profile='release', input_hash='abc')
+
+    def fail(*args, **kwargs):
+        raise AssertionError('digest recomputed for an unchanged archive')
+
+    monkeypatch.setattr(artifacts, 'file_sha256', fail)
+    again = index.add(archive)
+    assert again['sha256'] == first['sha256']
+    assert again['profile'] == 'release' and again['input_hash'] == 'abc'
+
+    monkeypatch.undo()
+    archive.write_bytes(b'rebuilt with different content')
+    os.utime(archive, (first['mtime'] + 10, first['mtime'] + 10))
+    assert index.add(archive)['sha256'] != first['sha256']
+
+
+def test_duplicates_are_found_by_digest(index, tmp_path):
+    one = index.add(make_archive(tmp_path, 'sqlite-3.45.0-1-linux.tar.gz', content='same'))
+    index.add(make_archive(tmp_path, 'sqlite-3.45.0-2-linux.tar.gz', content='same'))
+    assert [r['filename'] for r in index.duplicates(one)] == ['sqlite-3.45.0-2-linux.tar.gz']
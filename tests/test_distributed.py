@@ -0,0 +1,94 @@
+import sqlite3
+from pathlib import Path
+
+import pytest
+
+from ccdc.thirdparty import distributed
+from ccdc.thirdparty.distributed import BuildJob, BuildJobError, Coordinator, LocalWorkers
+
+TESTS = Path(__file__).resolve().parent
+
+
+@pytest.fixture(autouse=True)
+def environment(tmp_path, monkeypatch):
+    # workers are separate processes, so they find the recipes through PYTHONPATH
+    monkeypatch.setenv('PYTHONPATH', f'{TESTS.parent}{distributed.os.pathsep}{TESTS}')
+    monkeypatch.setenv('CCDC_ARTIFACT_INDEX', str(tmp_path / 'artifacts.sqlite'))
+    monkeypatch.syspath_prepend(str(TESTS))
+
+
+def test_local_workers_build_end_to_end(tmp_path):
+    output = tmp_path / 'out'
+    assert distributed.main(['build', '--local-workers', '2', '--output-directory', str(output),
+                             'distributed_recipes:QuickRecipe', 'distributed_recipes:OtherRecipe']) == 0
+    assert sorted(p.name for p in output.iterdir()) == ['other-1.0-1-linux.tar.gz', 'quick-1.0-1-linux.tar.gz']
+    from ccdc.thirdparty.artifacts import ArtifactIndex
+    with ArtifactIndex() as index:
+        assert index.latest('quick')['input_hash'] == 'test-inputs'
+
+
+def test_failing_recipe_fails_the_build(tmp_path):
+    output = tmp_path / 'out'
+    assert distributed.main(['build', '--local-workers', '2', '--output-directory', str(output),
+                             'distributed_recipes:QuickRecipe', 'distributed_recipes:BrokenRecipe']) == 1
+    assert [p.name for p in output.iterdir()] == ['quick-1.0-1-linux.tar.gz']
+
+
+def test_connect_timeout_does_not_limit_build_time(tmp_path):
+    with LocalWorkers(2) as workers:
+        results = Coordinator(workers.addresses, tmp_path, timeout=0.5).run(
+            [BuildJob('distributed_recipes:SlowRecipe')])
+    assert results['distributed_recipes:SlowRecipe'].exists()
+
+
+def test_unreachable_worker_hands_job_on(tmp_path):
+    with LocalWorkers(1) as workers:
+        results = Coordinator([('localhost', 1)] + workers.addresses, tmp_path).run(
+            [BuildJob('distributed_recipes:QuickRecipe'), BuildJob('distributed_recipes:OtherRecipe')])
+    assert set(results) == {'distributed_recipes:QuickRecipe', 'distributed_recipes:OtherRecipe'}
+
+
+def test_no_reachable_worker(tmp_path):
+    with pytest.raises(BuildJobError, match='no worker was available'):
+        Coordinator([('localhost', 1)], tmp_path).run([BuildJob('distributed_recipes:QuickRecipe')])
+
+
+def test_repeated_recipe_is_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        Coordinator([('localhost', 1)], tmp_path).run(
+            [BuildJob('distributed_recipes:QuickRecipe'), BuildJob('distributed_recipes:QuickRecipe')])
+
+
+def test_coordinator_side_failure_is_a_job_error(tmp_path, monkeypatch):
+    class LockedIndex(object):
+        def __enter__(self):
+            raise sqlite3.OperationalError('database is locked')
+
+        def __exit__(self, *args):
+            pass
+
+    monkeypatch.setattr(distributed, 'ArtifactIndex', LockedIndex)
+    with LocalWorkers(2) as workers:
+        with pytest.raises(BuildJobError, match='database is locked'):
+            Coordinator(workers.addresses, tmp_path).run(
+                [BuildJob('distributed_recipes:QuickRecipe'), BuildJob('distributed_recipes:OtherRecipe')])
+
+
+def test_jobs_are_not_pinned_to_the_coordinator_inputs(tmp_path, monkeypatch):
+    from distributed_recipes import QuickRecipe
+    # as if the coordinator ran on another platform
+    monkeypatch.setattr(QuickRecipe, 'input_hash', 'coordinator-inputs')
+    job = BuildJob.for_package(QuickRecipe)
+    assert job.input_hash is None
+    with LocalWorkers(1) as workers:
+        assert Coordinator(workers.addresses, tmp_path).run([job])['distributed_recipes:QuickRecipe'].exists()
+    from ccdc.thirdparty.artifacts import ArtifactIndex
+    with ArtifactIndex() as index:
+        assert index.latest('quick')['input_hash'] == 'test-inputs'
+
+
+def test_pinned_input_hash_mismatch_is_rejected(tmp_path):
+    with LocalWorkers(1) as workers:
+        with pytest.raises(BuildJobError, match='coordinator expected other-inputs'):
+            Coordinator(workers.addresses, tmp_path).run(
+                [BuildJob('distributed_recipes:QuickRecipe', input_hash='other-inputs')])
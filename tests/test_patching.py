@@ -0,0 +1,227 @@
+import os
+import random
+import re
+
+import pytest
+
+from ccdc.thirdparty.patching import MultiReplacer, PatchError, apply_unified_diff, patch_file
+
+
+def reference_replace(subs, text):
+    '''Leftmost-longest replacement, first substitution winning for repeated strings'''
+    replacements = {}
+    for old, new in subs:
+        replacements.setdefault(old, new)
+    pattern = re.compile('|'.join(re.escape(old) for old in sorted(replacements, key=len, reverse=True)))
+    return pattern.sub(lambda m: replacements[m.group(0)], text)
+
+
+def feed_in_chunks(replacer, text, sizes):
+    replacer.reset()
+    out = []
+    i = 0
+    while i < len(text):
+        size = next(sizes)
+        out.append(replacer.feed(text[i:i + size]))
+        i += size
+    out.append(replacer.finish())
+    return ''.join(out)
+
+
+def test_chunked_and_whole_string_agree_with_reference():
+    generator = random.Random(1234)
+    for _ in range(2000):
+        olds = {''.join(generator.choice('abc') for _ in range(generator.randint(1, 4))) for _ in range(generator.randint(1, 4))}
+        subs = [(old, generator.choice(['X', '', 'YY', old])) for old in olds]
+        text = ''.join(generator.choice('abc\n') for _ in range(generator.randint(0, 60)))
+        expected = reference_replace(subs, text)
+        replacer = MultiReplacer(subs)
+        assert replacer.replace(text) == expected
+        sizes = iter(lambda: generator.randint(1, 5), None)
+        assert feed_in_chunks(replacer, text, sizes) == expected
+
+
+def test_match_spanning_chunk_boundary():
+    replacer = MultiReplacer([('hello world', 'bye')])
+    assert feed_in_chunks(replacer, 'say hello world!', iter([1] * 16)) == 'say bye!'
+
+
+def test_leftmost_match_wins():
+    # 'bc' ends first, but 'abcd' starts further left
+    assert MultiReplacer([('bc', 'X'), ('abcd', 'Y')]).replace('abcde') == 'Ye'
+
+
+def test_longest_match_wins_at_the_same_position():
+    assert MultiReplacer([('a', 'b'), ('ab', 'X')]).replace('ab') == 'X'
+
+
+def test_first_substitution_wins_for_repeated_strings():
+    assert MultiReplacer([('a', '1'), ('a', '2')]).replace('aa') == '11'
+
+
+def test_replaced_text_is_not_rescanned():
+    assert MultiReplacer([('foo', 'bar'), ('bar', 'baz')]).replace('foo bar') == 'bar baz'
+
+
+def test_empty_substitution_is_rejected():
+    with pytest.raises(ValueError):
+        MultiReplacer([('', 'x')])
+
+
+def test_unmatched_substitutions_are_reported(tmp_path):
+    source = tmp_path / 'source.c'
+    source.write_text('int x = 1;\n')
+    unmatched = patch_file(source, [('x = 1', 'x = 2'), ('missing', 'y')])
+    assert unmatched == [('missing', 'y')]
+    assert source.read_text() == 'int x = 2;\n'
+
+
+def test_file_untouched_when_nothing_changes(tmp_path):
+    source = tmp_path / 'source.c'
+    source.write_text('int x = 1;\n')
+    os.utime(source, (1000000000, 1000000000))
+    inode = source.stat().st_ino
+    # an identity substitution matches but changes nothing
+    assert patch_file(source, [('nothing', 'here'), ('int', 'int')]) == [('nothing', 'here')]
+    assert source.stat().st_mtime == 1000000000
+    assert source.stat().st_ino == inode
+    assert [p.name for p in tmp_path.iterdir()] == ['source.c']
+
+
+def test_patching_keeps_mode(tmp_path):
+    script = tmp_path / 'configure'
+    script.write_text('#!/bin/sh\necho old\n')
+    script.chmod(0o750)
+    patch_file(script, [('old', 'new')])
+    assert script.read_text() == '#!/bin/sh\necho new\n'
+    assert script.stat().st_mode & 0o777 == 0o750
+
+
+def write_tree(root, files):
+    for name, content in files.items():
+        (root / name).parent.mkdir(parents=True, exist_ok=True)
+        (root / name).write_text(content)
+
+
+def read_tree(root):
+    return {str(p.relative_to(root)): p.read_text() for p in sorted(root.rglob('*')) if p.is_file()}
+
+
+MODIFY = '''\
+--- a/src/main.c\t2024-01-01 10:00:00.000000000 +0000
++++ b/src/main.c\t2024-01-02 10:00:00.000000000 +0000
+@@ -1,4 +1,4 @@
+ one
+-two
++TWO
+ three
+ four
+'''
+
+
+def test_modify_with_offset(tmp_path):
+    # two extra lines at the top push the hunk away from where it says it applies
+    write_tree(tmp_path, {'src/main.c': 'zero\nzero\none\ntwo\nthree\nfour\n'})
+    assert apply_unified_diff(write_patch(tmp_path, MODIFY), tmp_path) == [tmp_path / 'src/main.c']
+    assert read_tree(tmp_path)['src/main.c'] == 'zero\nzero\none\nTWO\nthree\nfour\n'
+
+
+def write_patch(tmp_path, text):
+    patch = tmp_path.parent / f'{tmp_path.name}.diff'
+    patch.write_text(text)
+    return patch
+
+
+CREATE_AND_DELETE = '''\
+diff -ruN a/gone.c b/gone.c
+--- a/gone.c\t2024-01-01 10:00:00.000000000 +0000
++++ b/gone.c\t1970-01-01 00:00:00.000000000 +0000
+@@ -1,2 +0,0 @@
+-bye
+-now
+diff -ruN a/new.c b/new.c
+--- a/new.c\t1970-01-01 01:00:00.000000000 +0100
++++ b/new.c\t2024-01-01 10:00:00.000000000 +0000
+@@ -0,0 +1,2 @@
++brand
++new
+'''
+
+
+def test_diff_n_creates_and_deletes(tmp_path):
+    write_tree(tmp_path, {'gone.c': 'bye\nnow\n'})
+    umask = os.umask(0o022)
+    try:
+        apply_unified_diff(write_patch(tmp_path, CREATE_AND_DELETE), tmp_path)
+    finally:
+        os.umask(umask)
+    assert read_tree(tmp_path) == {'new.c': 'brand\nnew\n'}
+    assert (tmp_path / 'new.c').stat().st_mode & 0o777 == 0o644
+
+
+DEV_NULL = '''\
+--- /dev/null
++++ b/added.c
+@@ -0,0 +1 @@
++added
+--- a/removed.c
++++ /dev/null
+@@ -1 +0,0 @@
+-removed
+'''
+
+
+def test_dev_null_creates_and_deletes(tmp_path):
+    write_tree(tmp_path, {'removed.c': 'removed\n'})
+    apply_unified_diff(write_patch(tmp_path, DEV_NULL), tmp_path)
+    assert read_tree(tmp_path) == {'added.c': 'added\n'}
+
+
+EMPTY = '''\
+--- a/emptied.c\t2024-01-01 10:00:00.000000000 +0000
++++ b/emptied.c\t2024-01-02 10:00:00.000000000 +0000
+@@ -1,2 +0,0 @@
+-all
+-gone
+'''
+
+
+def test_emptying_a_file_keeps_it(tmp_path):
+    write_tree(tmp_path, {'emptied.c': 'all\ngone\n'})
+    apply_unified_diff(write_patch(tmp_path, EMPTY), tmp_path)
+    assert read_tree(tmp_path) == {'emptied.c': ''}
+
+
+NO_NEWLINE = '''\
+--- a/tail.c
++++ b/tail.c
+@@ -1,2 +1,2 @@
+ first
+-last
+\\ No newline at end of file
++last
+'''
+
+
+def test_no_newline_at_end_of_file(tmp_path):
+    write_tree(tmp_path, {'tail.c': 'first\nlast'})
+    apply_unified_diff(write_patch(tmp_path, NO_NEWLINE), tmp_path)
+    assert read_tree(tmp_path)['tail.c'] == 'first\nlast\n'
+
+
+BAD_SECOND_FILE = MODIFY + '''\
+--- a/other.c
++++ b/other.c
+@@ -1,2 +1,2 @@
+ not
+-there
++here
+'''
+
+
+def test_failing_hunk_leaves_tree_untouched(tmp_path):
+    write_tree(tmp_path, {'src/main.c': 'one\ntwo\nthree\nfour\n', 'other.c': 'something\nelse\n'})
+    before = read_tree(tmp_path)
+    with pytest.raises(PatchError):
+        apply_unified_diff(write_patch(tmp_path, BAD_SECOND_FILE), tmp_path)
+    assert read_tree(tmp_path) == before
@@ -0,0 +1,96 @@
+import io
+import json
+import subprocess
+import sys
+
+import pytest
+
+from ccdc.thirdparty import progress
+from ccdc.thirdparty.progress import HISTORY_LENGTH, PhaseTimings, ProgressReporter, run_logged
+
+
+@pytest.fixture
+def stream():
+    return io.StringIO()
+
+
+@pytest.fixture
+def timings_path(tmp_path):
+    return tmp_path / 'logs' / progress.TIMINGS_FILENAME
+
+
+def python_command(code):
+    return [sys.executable, '-c', code]
+
+
+def run(mode, stream, monkeypatch, tmp_path, timings_path, command):
+    # run_logged reports through the shared reporter
+    monkeypatch.setattr(progress, '_reporter', ProgressReporter(mode=mode, stream=stream))
+    run_logged(command, 'test run', 'test run', timings_path, tmp_path / 'log.txt')
+
+
+def test_output_is_logged_and_echoed_in_ci_mode(stream, monkeypatch, tmp_path, timings_path):
+    run('ci', stream, monkeypatch, tmp_path, timings_path, python_command('print("one"); print("two", end="")'))
+    assert (tmp_path / 'log.txt').read_text() == 'one\ntwo'
+    assert stream.getvalue() == 'one\ntwo\n'
+    assert len(PhaseTimings(timings_path).load()['test run']) == 1
+
+
+def test_estimate_is_the_median_of_the_last_runs(stream, monkeypatch, tmp_path, timings_path):
+    timings_path.parent.mkdir()
+    # the outlier is the oldest entry, so it drops out once another run is recorded
+    timings_path.write_text(json.dumps({'test run': [1000, 1, 2, 3, 4, 5, 6, 7, 8, 9]}))
+    assert PhaseTimings(timings_path).estimate('test run') == 5.5
+    run('off', stream, monkeypatch, tmp_path, timings_path, python_command('pass'))
+    history = PhaseTimings(timings_path).load()['test run']
+    assert len(history) == HISTORY_LENGTH
+    assert history[:-1] == [1, 2, 3, 4, 5, 6, 7, 8, 9]
+    assert PhaseTimings(timings_path).estimate('test run') == 4.5
+    assert PhaseTimings(timings_path).estimate('unknown') is None
+
+
+def test_record_is_atomic(tmp_path, monkeypatch):
+    timings_path = tmp_path / progress.TIMINGS_FILENAME
+    PhaseTimings(timings_path).record('test run', 1.0)
+    before = timings_path.read_text()
+
+    def interrupted_dump(timings, f, **kwargs):
+        f.write('{"test run": [')
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(progress.json, 'dump', interrupted_dump)
+    with pytest.raises(KeyboardInterrupt):
+        PhaseTimings(timings_path).record('test run', 2.0)
+    assert timings_path.read_text() == before
+    assert [p.name for p in tmp_path.iterdir()] == [progress.TIMINGS_FILENAME]
+
+
+def test_slow_phase_is_flagged_once(stream, monkeypatch, tmp_path, timings_path):
+    PhaseTimings(timings_path).record('test run', 0.01)
+    monkeypatch.setattr(progress, 'SLOW_MINIMUM_SECONDS', 0)
+    monkeypatch.setattr(progress, 'CI_INTERVAL', 0.05)
+    run('ci', stream, monkeypatch, tmp_path, timings_path, python_command('import time; time.sleep(0.5)'))
+    assert stream.getvalue().count('WARNING: test run has been running for') == 1
+
+
+def test_periodic_summary_in_ci_mode(stream, monkeypatch, tmp_path, timings_path):
+    monkeypatch.setattr(progress, 'CI_INTERVAL', 0.05)
+    run('ci', stream, monkeypatch, tmp_path, timings_path, python_command('import time; time.sleep(0.5)'))
+    assert '[progress] test run: ' in stream.getvalue()
+    assert '(no history), 0 lines' in stream.getvalue()
+
+
+def test_failure_shows_tail_in_tty_mode(stream, monkeypatch, tmp_path, timings_path):
+    code = 'import sys\nfor i in range(100): print(f"line {i}")\nsys.exit(3)'
+    with pytest.raises(subprocess.CalledProcessError) as failure:
+        run('tty', stream, monkeypatch, tmp_path, timings_path, python_command(code))
+    assert failure.value.returncode == 3
+    output = stream.getvalue()
+    assert 'test run failed after ' in output
+    tail = output.split('last output:\n')[1].splitlines()
+    assert tail[:progress.FAILURE_TAIL_LINES] == [f'    line {i}' for i in range(100 - progress.FAILURE_TAIL_LINES, 100)]
+    # raw output only goes to the log in tty mode
+    assert '    line 0\n' not in output
+    assert (tmp_path / 'log.txt').read_text().startswith('line 0\n')
+    # failed runs do not count towards the estimate
+    assert not timings_path.exists()
@@ -0,0 +1,80 @@
+import os
+import sys
+import tarfile
+import subprocess
+
+import pytest
+
+from ccdc.thirdparty.artifacts import file_sha256
+from ccdc.thirdparty.reproducible import create_reproducible_archive, compile_checked_hash_pycs
+
+EPOCH = 1700000000
+
+
+@pytest.fixture
+def tree(tmp_path):
+    package = tmp_path / 'tree' / 'pkg-1.0'
+    (package / 'lib').mkdir(parents=True)
+    (package / 'empty').mkdir()
+    (package / 'lib' / 'a.txt').write_text('a\n')
+    (package / 'lib' / 'big').write_text('x' * 100000)
+    (package / 'run.sh').write_text('#!/bin/sh\n')
+    (package / 'run.sh').chmod(0o755)
+    os.symlink('lib/a.txt', package / 'link')
+    os.link(package / 'lib' / 'a.txt', package / 'hard')
+    return package
+
+
+def test_same_tree_gives_identical_archives(tree, tmp_path):
+    first = tmp_path / 'first.tar.gz'
+    second = tmp_path / 'second.tar.gz'
+    create_reproducible_archive(tree.parent, tree.name, first, epoch=EPOCH)
+
+    # everything tar would otherwise record differently (mtimes stay newer than the epoch they are clamped to)
+    os.utime(tree / 'lib' / 'a.txt', (EPOCH + 1000, EPOCH + 1000))
+    os.utime(tree / 'run.sh', (EPOCH + 5000, EPOCH + 5000))
+    (tree / 'lib' / 'big').chmod(0o600)
+    (tree / 'lib' / 'big').rename(tree / 'big')
+    (tree / 'big').rename(tree / 'lib' / 'big')
+    umask = os.umask(0o077)
+    try:
+        create_reproducible_archive(tree.parent, tree.name, second, epoch=EPOCH)
+    finally:
+        os.umask(umask)
+
+    assert file_sha256(first) == file_sha256(second)
+
+
+def test_archive_is_normalised(tree, tmp_path):
+    output = tmp_path / 'out.tar.gz'
+    create_reproducible_archive(tree.parent, tree.name, output, epoch=EPOCH)
+    with tarfile.open(output) as archive:
+        members = archive.getmembers()
+    names = [m.name for m in members]
+    assert names[0] == 'pkg-1.0'
+    assert all(m.uid == 0 and m.gid == 0 and m.uname == '' and m.gname == '' for m in members)
+    assert all(m.mtime <= EPOCH for m in members)
+    by_name = {m.name: m for m in members}
+    assert by_name['pkg-1.0/link'].issym() and by_name['pkg-1.0/link'].linkname == 'lib/a.txt'
+    assert by_name['pkg-1.0/lib/a.txt'].islnk() or by_name['pkg-1.0/hard'].islnk()
+    assert by_name['pkg-1.0/run.sh'].mode == 0o755
+    assert by_name['pkg-1.0/lib/big'].mode == 0o644
+    with open(output, 'rb') as f:
+        header = f.read(10)
+    assert header[4:8] == b'\0\0\0\0'  # no gzip timestamp
+
+
+def test_pycs_use_checked_hash(tmp_path):
+    (tmp_path / 'module.py').write_text('x = 1\n')
+    (tmp_path / 'badsyntax_fixture.py').write_text('def (\n')
+    compile_checked_hash_pycs(sys.executable, tmp_path)
+    pycs = list((tmp_path / '__pycache__').glob('module.*.pyc'))
+    assert len(pycs) == 3
+    for pyc in pycs:
+        assert int.from_bytes(pyc.read_bytes()[4:8], 'little') == 3  # hash based, checked
+
+
+def test_pyc_compilation_failure_is_reported(tmp_path):
+    (tmp_path / 'broken.py').write_text('def (\n')
+    with pytest.raises(subprocess.CalledProcessError):
+        compile_checked_hash_pycs(sys.executable, tmp_path)